@@ -2,12 +2,17 @@ import os
 import streamlit as st
 import tempfile
 import uuid
+import statistics
+from collections import deque
 from datetime import datetime
 from dotenv import load_dotenv
-from llama_index.core import SimpleDirectoryReader, VectorStoreIndex, StorageContext, load_index_from_storage
+from llama_index.core import SimpleDirectoryReader, VectorStoreIndex, StorageContext, load_index_from_storage, get_response_synthesizer, Settings
 from llama_index.llms.together import TogetherLLM
 from llama_index.embeddings.together import TogetherEmbedding
 from llama_index.core.postprocessor import SimilarityPostprocessor
+from llama_index.core.prompts.default_prompts import DEFAULT_TEXT_QA_PROMPT_TMPL
+from llama_index.core.schema import MetadataMode
+from llama_index.core.utils import get_tokenizer
 from langfuse import Langfuse
 from langfuse.llama_index import LlamaIndexCallbackHandler
 from llama_index.core.callbacks import CallbackManager
@@ -124,6 +129,190 @@ def load_css():
     </style>
     """, unsafe_allow_html=True)
 
+# Option shown in the model selector that enables per-query routing
+AUTO_ROUTE_OPTION = "⚡ Auto (cost/latency-aware)"
+
+# Routing profile for each supported LLM: size tier, context window (tokens),
+# input and output price (USD per 1M tokens), a fixed per-call overhead
+# (seconds, network + prompt processing) and a decoding throughput prior
+# (output tokens/second) used until real observations have been collected.
+# Prices are Together serverless list prices from https://www.together.ai/pricing;
+# legacy models without their own entry use the per-size bracket there
+# (up to 8B, 8.1B-21B). Update them here when Together's pricing changes
+LLM_PROFILES = {
+    "mistralai/Mistral-7B-Instruct-v0.2": {"tier": "small", "context_window": 32768, "input_price_per_m": 0.20, "output_price_per_m": 0.20, "overhead": 0.5, "tokens_per_second_prior": 120},
+    "meta-llama/Llama-2-13b-chat-hf": {"tier": "medium", "context_window": 4096, "input_price_per_m": 0.30, "output_price_per_m": 0.30, "overhead": 0.6, "tokens_per_second_prior": 80},
+    "togethercomputer/Llama-2-7B-32K-Instruct": {"tier": "small", "context_window": 32768, "input_price_per_m": 0.20, "output_price_per_m": 0.20, "overhead": 0.6, "tokens_per_second_prior": 100},
+    "mistralai/Mixtral-8x7B-Instruct-v0.1": {"tier": "medium", "context_window": 32768, "input_price_per_m": 0.60, "output_price_per_m": 0.60, "overhead": 0.7, "tokens_per_second_prior": 90},
+    "Qwen/Qwen3-235B-A22B-fp8-tput": {"tier": "large", "context_window": 40960, "input_price_per_m": 0.20, "output_price_per_m": 0.60, "overhead": 1.5, "tokens_per_second_prior": 40},
+}
+LLM_MODELS = list(LLM_PROFILES.keys())
+
+# Tiers tried for each difficulty class, in order of preference
+ROUTE_TIERS = {
+    "easy": ["small", "medium", "large"],
+    "medium": ["medium", "large"],
+    "hard": ["large", "medium"],
+}
+
+ROUTER_TOP_K = 2                # same as the default query engine top-k
+# Difficulty thresholds, calibrated for the default 0.7 similarity cutoff and
+# top-k of 2. A ten-word question whose best hit sits mid-way between the
+# cutoff and 1.0, with two full chunks of near-tied hits, scores about 0.53
+# (easy); a 30-word question with a strong hit scores about 0.65 (medium).
+# Query length carries 0.35 of the blended score, so retrieval alone can't
+# reach the hard threshold; a separate retrieval-only escalation sends any
+# question whose best hit is within ~0.05 of the cutoff among near-tied hits
+# to the large tier, however short it is. A short question with a strong,
+# clearly separated hit still routes as easy even if answering it needs
+# reasoning, since nothing this cheap can tell that apart from a lookup
+ROUTER_EASY_THRESHOLD = 0.6     # difficulty below this is an easy lookup
+ROUTER_HARD_THRESHOLD = 0.75    # difficulty at or above this escalates to a large model
+ROUTER_ESCALATE_RETRIEVAL = 0.85  # retrieval difficulty at or above this escalates on its own
+ROUTER_WINDOW = 20              # rolling window of observations per model
+EXPECTED_OUTPUT_TOKENS = 256    # used for cost and context estimates before generation
+# Prompts are counted with LlamaIndex's default (tiktoken) tokenizer; the Llama
+# and Mistral tokenizers typically need more tokens for the same text, so the
+# context-window check pads the prompt before treating a model as fitting
+CONTEXT_SAFETY_MARGIN = 1.25
+
+
+def estimate_tokens(text):
+    """Count tokens locally with LlamaIndex's tokenizer so routing adds no API calls."""
+    return max(1, len(get_tokenizer()(text)))
+
+
+def record_model_stats(model, latency_seconds, output_tokens):
+    """Add an observed latency/throughput sample to the model's rolling window."""
+    window = st.session_state.model_stats.setdefault(model, deque(maxlen=ROUTER_WINDOW))
+    # Throughput is measured over decoding time only; keep at least a quarter of
+    # the latency for decoding so a faster-than-expected call can't inflate it
+    decode_seconds = max(latency_seconds - LLM_PROFILES[model]["overhead"], latency_seconds / 4)
+    window.append({
+        "latency": latency_seconds,
+        "tokens_per_second": output_tokens / decode_seconds if decode_seconds > 0 else 0.0,
+    })
+
+
+def summarize_model_stats(model):
+    """Return rolling median latency and throughput for a model, or None without samples."""
+    window = st.session_state.model_stats.get(model)
+    if not window:
+        return None
+    return {
+        "samples": len(window),
+        "median_latency": statistics.median(s["latency"] for s in window),
+        "median_tokens_per_second": statistics.median(s["tokens_per_second"] for s in window),
+    }
+
+
+def classify_query(query, nodes, similarity_cutoff):
+    """Score query difficulty from retrieval score spread, context size and query length."""
+    scores = sorted((n.score or 0.0 for n in nodes), reverse=True)
+    # Count the node text as the synthesizer sends it, including metadata
+    context_tokens = sum(estimate_tokens(n.get_content(metadata_mode=MetadataMode.LLM)) for n in nodes)
+    query_words = len(query.split())
+
+    if not scores:
+        # Nothing cleared the similarity cutoff, so no model is called at all
+        retrieval_difficulty = 1.0
+        top_score, score_spread = 0.0, 0.0
+    else:
+        top_score = scores[0]
+        score_spread = top_score - scores[-1]
+        # Every surviving hit scores in [cutoff, 1], so both signals are scaled
+        # over that range. A top hit well above the cutoff is a lookup; flat
+        # scores mean the answer is spread across chunks, but near-ties are
+        # common after the cutoff so they weigh less than the match strength
+        score_range = max(1.0 - similarity_cutoff, 0.05)
+        weak_match = min(max((1.0 - top_score) / score_range, 0.0), 1.0)
+        flat_scores = 1.0 - min(score_spread / (score_range / 2), 1.0) if len(scores) > 1 else 0.0
+        retrieval_difficulty = 0.7 * weak_match + 0.3 * flat_scores
+
+    # Context is measured against a full top-k of chunks, which most queries
+    # reach, so it only separates queries against small documents
+    context_load = min(context_tokens / (ROUTER_TOP_K * Settings.chunk_size), 1.0)
+
+    difficulty = (
+        0.5 * retrieval_difficulty
+        + 0.15 * context_load
+        + 0.35 * min(query_words / 40, 1.0)
+    )
+
+    if scores and retrieval_difficulty >= ROUTER_ESCALATE_RETRIEVAL:
+        # A barely-relevant best hit among near-tied scores needs the large model
+        # to reason over weak evidence, whatever the question length
+        difficulty_class = "hard"
+    elif difficulty < ROUTER_EASY_THRESHOLD:
+        difficulty_class = "easy"
+    elif difficulty < ROUTER_HARD_THRESHOLD:
+        difficulty_class = "medium"
+    else:
+        difficulty_class = "hard"
+
+    return {
+        "difficulty": round(difficulty, 3),
+        "difficulty_class": difficulty_class,
+        "retrieval_difficulty": round(retrieval_difficulty, 3),
+        "top_score": round(top_score, 3),
+        "score_spread": round(score_spread, 3),
+        "context_tokens": context_tokens,
+        "query_words": query_words,
+    }
+
+
+def route_model(query, nodes, similarity_cutoff):
+    """Pick the cheapest/fastest model in the lowest tier suited to the query's difficulty."""
+    features = classify_query(query, nodes, similarity_cutoff)
+    prompt_tokens = (
+        estimate_tokens(DEFAULT_TEXT_QA_PROMPT_TMPL)
+        + features["context_tokens"]
+        + estimate_tokens(query)
+    )
+    required_context = int(prompt_tokens * CONTEXT_SAFETY_MARGIN) + EXPECTED_OUTPUT_TOKENS
+
+    candidates = []
+    for tier in ROUTE_TIERS[features["difficulty_class"]]:
+        candidates = [
+            model for model, profile in LLM_PROFILES.items()
+            if profile["tier"] == tier and profile["context_window"] >= required_context
+        ]
+        if candidates:
+            break
+    if not candidates:
+        # Nothing fits the context comfortably; fall back to the largest window
+        candidates = [max(LLM_PROFILES, key=lambda m: LLM_PROFILES[m]["context_window"])]
+
+    estimates = {}
+    for model in candidates:
+        profile = LLM_PROFILES[model]
+        stats = summarize_model_stats(model)
+        tokens_per_second = stats["median_tokens_per_second"] if stats else profile["tokens_per_second_prior"]
+        estimates[model] = {
+            "expected_latency": profile["overhead"] + EXPECTED_OUTPUT_TOKENS / max(tokens_per_second, 1.0),
+            "expected_cost_usd": (
+                prompt_tokens * profile["input_price_per_m"]
+                + EXPECTED_OUTPUT_TOKENS * profile["output_price_per_m"]
+            ) / 1_000_000,
+            "samples": stats["samples"] if stats else 0,
+        }
+
+    # Normalise latency and cost within the candidate set and weigh them equally
+    max_latency = max(e["expected_latency"] for e in estimates.values()) or 1.0
+    max_cost = max(e["expected_cost_usd"] for e in estimates.values()) or 1.0
+    chosen = min(
+        estimates,
+        key=lambda m: estimates[m]["expected_latency"] / max_latency + estimates[m]["expected_cost_usd"] / max_cost,
+    )
+
+    return chosen, {
+        **features,
+        "chosen_model": chosen,
+        "chosen_tier": LLM_PROFILES[chosen]["tier"],
+        "candidates": {m: {k: round(v, 6) if isinstance(v, float) else v for k, v in e.items()} for m, e in estimates.items()},
+    }
+
+
 # Set page configuration - MUST BE FIRST STREAMLIT COMMAND
 st.set_page_config(page_title="Document QA Chatbot", page_icon="🤖", layout="wide")
 
@@ -259,12 +448,12 @@ with st.sidebar:
     
     llm_model = st.selectbox(
         "LLM Model",
-        ["mistralai/Mistral-7B-Instruct-v0.2", 
-         "meta-llama/Llama-2-13b-chat-hf",
-         "togethercomputer/Llama-2-7B-32K-Instruct",
-         "mistralai/Mixtral-8x7B-Instruct-v0.1",
-         "Qwen/Qwen3-235B-A22B-fp8-tput"]
+        LLM_MODELS + [AUTO_ROUTE_OPTION],
+        help="Auto routes easy lookups to small fast models and hard questions to a large model"
     )
+    auto_route = llm_model == AUTO_ROUTE_OPTION
+    # Concrete model id for code that needs one LLM outside per-query routing
+    default_model = LLM_MODELS[0] if auto_route else llm_model
     
     embedding_model = st.selectbox(
         "Embedding Model",
@@ -288,6 +477,10 @@ with st.sidebar:
     
     st.markdown("</div>", unsafe_allow_html=True)
     
+    # Placeholder for rolling per-model stats, filled at the end of the run so
+    # it reflects the query processed in this run
+    model_performance_panel = st.empty()
+    
     # Actions section with styled buttons
     st.markdown("""
     <div style="background-color: white; padding: 15px; border-radius: 10px; margin-bottom: 20px; box-shadow: 0 2px 5px rgba(0,0,0,0.1);">
@@ -317,6 +510,10 @@ if 'ready' not in st.session_state:
     st.session_state.ready = False
 if 'session_id' not in st.session_state:
     st.session_state.session_id = str(uuid.uuid4())
+if 'model_stats' not in st.session_state:
+    st.session_state.model_stats = {}
+if 'last_routing' not in st.session_state:
+    st.session_state.last_routing = None
 
 # Main section with two columns for chat and file upload
 col_chat, col_upload = st.columns([2, 1])
@@ -460,7 +657,7 @@ if uploaded_files and not st.session_state.ready and together_api_key:
         
         # Initialize LLM and embedding model
         llm = TogetherLLM(
-            model=llm_model,
+            model=default_model,
             api_key=together_api_key,
             callback_manager=callback_manager
         )
@@ -534,29 +731,49 @@ if st.session_state.ready and query:
     
     # Display assistant response
     with st.spinner("Searching for information..."):
-        # Create query engine with similarity reranker
+        # Similarity reranker applied to retrieved nodes in both manual and auto mode
         reranker = SimilarityPostprocessor(similarity_cutoff=similarity_threshold)
         
         # Create a unique trace ID for this query
         query_id = f"query_{str(uuid.uuid4())}"
         
-        # Initialize query engine with callback manager
-        query_engine = st.session_state.index.as_query_engine(
-            llm=TogetherLLM(
-                model=llm_model, 
-                api_key=together_api_key,
-                callback_manager=callback_manager
-            ),
-            postprocessors=[reranker]
-        )
+        routing = None
         
         try:
             start_time = datetime.now()
-            # Get response
-            response = query_engine.query(query)
+            # Retrieve and filter first so both modes answer from the same nodes
+            # and retrieval scores and context size can drive model choice
+            # The index already carries the callback manager it was built with
+            retriever = st.session_state.index.as_retriever(similarity_top_k=ROUTER_TOP_K)
+            nodes = reranker.postprocess_nodes(retriever.retrieve(query), query_str=query)
+            
+            if auto_route:
+                selected_model, routing = route_model(query, nodes, similarity_threshold)
+                st.session_state.last_routing = routing
+            else:
+                selected_model = llm_model
+            
+            synthesizer = get_response_synthesizer(
+                llm=TogetherLLM(
+                    model=selected_model,
+                    api_key=together_api_key,
+                    callback_manager=callback_manager
+                ),
+                callback_manager=callback_manager
+            )
+            
+            # Time only the generation step so samples are comparable across modes
+            generation_start = datetime.now()
+            response = synthesizer.synthesize(query, nodes=nodes)
             response_text = str(response)
+            generation_time = (datetime.now() - generation_start).total_seconds()
             query_time = (datetime.now() - start_time).total_seconds()
             
+            # Without source nodes the synthesizer returns "Empty Response" without
+            # calling the LLM, so only real generations feed the rolling window
+            if response.source_nodes:
+                record_model_stats(selected_model, generation_time, estimate_tokens(response_text))
+            
             # Log query and response manually
             if langfuse_available and langfuse_client:
                 query_time = (datetime.now() - start_time).total_seconds()
@@ -570,8 +787,11 @@ if st.session_state.ready and query:
                         metadata={
                             "query": query,
                             "response": response_text,
-                            "model": llm_model,
+                            "model": selected_model,
+                            "routing_mode": "auto" if auto_route else "manual",
+                            "routing": routing,
                             "response_time_seconds": query_time,
+                            "generation_time_seconds": generation_time,
                             "similarity_threshold": similarity_threshold,
                             "sources_count": len(response.source_nodes) if hasattr(response, "source_nodes") else 0,
                             "session_id": st.session_state.session_id
@@ -601,6 +821,8 @@ if st.session_state.ready and query:
                         metadata={
                             "query": query,
                             "error": str(e),
+                            "routing_mode": "auto" if auto_route else "manual",
+                            "routing": routing,
                             "session_id": st.session_state.session_id
                         }
                     )
@@ -658,4 +880,19 @@ if 'reset_index' in locals() and reset_index:
     st.session_state.index = None
     st.session_state.ready = False
     st.session_state.messages = []
-    st.rerun()
\ No newline at end of file
+    st.rerun()
+
+# Rolling per-model latency/throughput that feeds the auto router
+if st.session_state.model_stats:
+    with model_performance_panel.container():
+        with st.expander("📈 Model Performance"):
+            for model in LLM_MODELS:
+                stats = summarize_model_stats(model)
+                if stats:
+                    st.caption(
+                        f"**{model.split('/')[-1]}**: {stats['median_latency']:.2f}s median, "
+                        f"{stats['median_tokens_per_second']:.1f} tok/s ({stats['samples']} samples)"
+                    )
+            if st.session_state.last_routing:
+                st.caption(f"Last routed to: {st.session_state.last_routing['chosen_model']} "
+                           f"({st.session_state.last_routing['difficulty_class']})")
\ No newline at end of file